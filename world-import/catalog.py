@@ -0,0 +1,98 @@
+import sqlite3, time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    source TEXT,
+    vertices INTEGER,
+    triangles INTEGER,
+    clump_depth INTEGER,
+    min_x REAL, min_y REAL, min_z REAL,
+    max_x REAL, max_y REAL, max_z REAL,
+    parse_time REAL,
+    convert_time REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS materials (
+    model TEXT REFERENCES models(name) ON DELETE CASCADE,
+    material INTEGER,
+    r REAL, g REAL, b REAL,
+    ambient REAL,
+    diffuse REAL,
+    specular REAL,
+    opacity REAL,
+    texture TEXT,
+    triangles INTEGER
+);
+CREATE TABLE IF NOT EXISTS tags (
+    model TEXT REFERENCES models(name) ON DELETE CASCADE,
+    tag INTEGER,
+    triangles INTEGER
+);
+CREATE INDEX IF NOT EXISTS models_triangles ON models(triangles);
+CREATE INDEX IF NOT EXISTS models_vertices ON models(vertices);
+CREATE INDEX IF NOT EXISTS materials_model ON materials(model);
+CREATE INDEX IF NOT EXISTS materials_texture ON materials(texture);
+CREATE INDEX IF NOT EXISTS tags_model ON tags(model);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags(tag);
+"""
+
+class ModelCatalog:
+    """
+    SQLite sidecar describing converted models
+
+    Rows for a model are replaced whenever it is converted again, so the
+    catalog can be updated incrementally alongside the model output.
+    """
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def update(self, name, scene, source=None, parse_time=None, convert_time=None):
+        clumps = list(scene.iter_clumps())
+
+        bounds = scene.bounds()
+        if(bounds is None):
+            bounds = ([None] * 3, [None] * 3)
+
+        material_triangles = {}
+        tag_triangles = {}
+        for clump in clumps:
+            for material in clump['materials'].tolist():
+                material_triangles[material] = material_triangles.get(material, 0) + 1
+            for tag in clump['tags'].tolist():
+                if(tag != 0):
+                    tag_triangles[tag] = tag_triangles.get(tag, 0) + 1
+
+        with self.db:
+            self.db.execute("DELETE FROM models WHERE name = ?", (name,))
+            self.db.execute(
+                "INSERT INTO models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, source,
+                 sum(c['source_vertices'] for c in clumps),
+                 sum(len(c['indices']) for c in clumps),
+                 max(c['depth'] for c in clumps) + 1,
+                 *[None if x is None else float(x) for x in bounds[0]],
+                 *[None if x is None else float(x) for x in bounds[1]],
+                 parse_time, convert_time, time.time()))
+
+            self.db.executemany(
+                "INSERT INTO materials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(name, i, *m['color'], m['ambient'], m['diffuse'], m['specular'],
+                  m['opacity'], m['texture'], material_triangles.get(i, 0))
+                 for (i, m) in enumerate(scene.materials)])
+
+            self.db.executemany(
+                "INSERT INTO tags VALUES (?, ?, ?)",
+                [(name, tag, count) for (tag, count) in tag_triangles.items()])
+
+    def close(self):
+        self.db.close()
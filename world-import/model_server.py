@@ -0,0 +1,403 @@
+import sys, os, re, hashlib, zipfile, mmap
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from rwxreader import RwxReader
+from rwxscene import RwxScene
+from normals import DEFAULT_CREASE_ANGLE
+from rwxtogltf import RwxToGltf
+from rwxtothree import RwxToThree
+
+FORMATS = {
+    'gltf': 'model/gltf+json',
+    'json': 'application/json',
+}
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+MODEL_PATH = re.compile(r'^/models/([A-Za-z0-9_\-]+)(?:/([A-Za-z0-9_\-]+))?\.(gltf|json)$')
+
+CACHE_FILE = re.compile(r'^(.+)-(\d+)\.(gltf|json)$')
+
+def find_member(zf, name):
+    """
+    Returns the .rwx member of zf called name, ignoring case and folders,
+    or None
+    """
+    for member in zf.namelist():
+        (base, extension) = os.path.splitext(os.path.basename(member))
+        if extension.lower() == ".rwx" and base.lower() == name.lower():
+            return member
+
+    return None
+
+def find_model(path, name, member=None):
+    """
+    Returns (filename, zip member) for the model name in path, or None
+
+    Without a member, <name>.zip serves its member called name, falling back
+    to its first .rwx member, and <name>.rwx is served directly. With a
+    member, it is looked up in <name>.zip.
+    """
+    filename = os.path.join(path, name + ".zip")
+    if os.path.isfile(filename):
+        with zipfile.ZipFile(filename) as zf:
+            if member is not None:
+                found = find_member(zf, member)
+            else:
+                found = find_member(zf, name) or next(
+                    (m for m in zf.namelist() if m.lower().endswith(".rwx")), None)
+
+        return (filename, found) if found is not None else None
+
+    filename = os.path.join(path, name + ".rwx")
+    if member is None and os.path.isfile(filename):
+        return (filename, None)
+
+    return None
+
+def parse_etags(value):
+    """
+    Returns the opaque tags of an If-None-Match header value as a set,
+    ignoring weak validator prefixes
+    """
+    tags = set()
+    for tag in value.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag:
+            tags.add(tag.strip('"'))
+
+    return tags
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def write_file(filename, data):
+    with open(filename + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(filename + ".tmp", filename)
+
+def remove_files(filenames):
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+def convert_model(filename, member, format, crease_angle=DEFAULT_CREASE_ANGLE):
+    """
+    Reads an RWX model, from member when filename is a zip, and returns it
+    serialized as format with normals split at crease_angle degrees
+
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    if member is not None:
+        with zipfile.ZipFile(filename) as zf:
+            rwx = RwxReader(zf.read(member))
+    else:
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                rwx = RwxReader(buffer)
+
+    scene = RwxScene(rwx.model, crease_angle)
+
+    if(format == 'gltf'):
+        return RwxToGltf(scene).to_json().encode('utf-8')
+    else:
+        return RwxToThree(scene).to_json(compact=True).encode('utf-8')
+
+class ModelServer:
+    """
+    Serves converted models over HTTP, converting them on demand
+
+    Requests for /models/<name>.gltf or /models/<name>.json, or for
+    /models/<zip>/<member>.gltf|json in archives holding several models, are
+    answered from a bounded in-memory cache, then from cache_path on disk,
+    and only then converted on a process pool. Concurrent requests for a model that
+    is being converted wait on the same job. The disk cache is kept under
+    disk_limit bytes, least recently used first, and drops conversions of a
+    model once a newer version of its source has been converted. Cached files
+    do not record crease_angle, so a cache_path should only be reused with
+    the same one.
+    """
+
+    def __init__(self, path, cache_path=None, memory_limit=64 * 1024 * 1024,
+                 disk_limit=1024 * 1024 * 1024, workers=None,
+                 crease_angle=DEFAULT_CREASE_ANGLE):
+        self.path = path
+        self.crease_angle = crease_angle
+        self.cache_path = cache_path
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        self.memory_cache = OrderedDict()
+        self.memory_size = 0
+        self.disk_cache = OrderedDict()
+        self.disk_size = 0
+        self.pending = {}
+
+        if self.cache_path is not None:
+            os.makedirs(self.cache_path, exist_ok=True)
+            self.load_disk_cache()
+
+    def cache_filename(self, key):
+        (name, mtime, format) = key
+        return os.path.join(self.cache_path, "%s-%d.%s" % (name.replace('/', '.'), mtime, format))
+
+    def load_disk_cache(self):
+        """
+        Picks up files cached by earlier runs, least recently used first
+        """
+        entries = []
+        for filename in os.listdir(self.cache_path):
+            match = CACHE_FILE.match(filename)
+            if match is None:
+                continue
+
+            stat = os.stat(os.path.join(self.cache_path, filename))
+            (name, mtime, format) = match.groups()
+            entries.append((stat.st_mtime, (name.replace('.', '/'), int(mtime), format), stat.st_size))
+
+        for (_, key, size) in sorted(entries):
+            self.disk_cache[key] = size
+            self.disk_size += size
+
+    async def cache_get(self, key):
+        if key in self.memory_cache:
+            self.memory_cache.move_to_end(key)
+            return self.memory_cache[key]
+
+        if key in self.disk_cache:
+            loop = asyncio.get_event_loop()
+            try:
+                data = await loop.run_in_executor(None, read_file, self.cache_filename(key))
+            except FileNotFoundError:
+                # Removed behind our back, forget it
+                if key in self.disk_cache:
+                    self.disk_size -= self.disk_cache.pop(key)
+                return None
+
+            if key in self.disk_cache:
+                self.disk_cache.move_to_end(key)
+
+            entry = (data, hashlib.sha1(data).hexdigest())
+            self.memory_put(key, entry)
+            return entry
+
+        return None
+
+    def memory_put(self, key, entry):
+        (data, _) = entry
+
+        if len(data) > self.memory_limit:
+            return
+
+        self.memory_cache[key] = entry
+        self.memory_size += len(data)
+
+        while self.memory_size > self.memory_limit:
+            (_, (evicted, _)) = self.memory_cache.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    async def cache_put(self, key, entry):
+        (data, _) = entry
+        (name, _, format) = key
+
+        # Conversions of older versions of the same source are never served
+        # again
+        for stale in [k for k in self.memory_cache if k[0] == name and k[2] == format and k != key]:
+            (evicted, _) = self.memory_cache.pop(stale)
+            self.memory_size -= len(evicted)
+
+        self.memory_put(key, entry)
+
+        if self.cache_path is None:
+            return
+
+        evicted = [k for k in self.disk_cache if k[0] == name and k[2] == format and k != key]
+        for k in evicted:
+            self.disk_size -= self.disk_cache.pop(k)
+
+        if key in self.disk_cache:
+            self.disk_size -= self.disk_cache.pop(key)
+
+        self.disk_cache[key] = len(data)
+        self.disk_size += len(data)
+
+        while self.disk_size > self.disk_limit and len(self.disk_cache) > 1:
+            (k, size) = self.disk_cache.popitem(last=False)
+            self.disk_size -= size
+            evicted.append(k)
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, write_file, self.cache_filename(key), data)
+        except OSError as e:
+            # The conversion itself succeeded, it is only not cached on disk
+            print("Could not cache %s: %s" % (self.cache_filename(key), e), file=sys.stderr)
+            if key in self.disk_cache:
+                self.disk_size -= self.disk_cache.pop(key)
+
+        await loop.run_in_executor(None, remove_files, [self.cache_filename(k) for k in evicted])
+
+    async def get_model(self, name, format, member=None):
+        """
+        Returns (data, etag) for a model, or None when it does not exist
+        """
+        loop = asyncio.get_event_loop()
+
+        found = await loop.run_in_executor(None, find_model, self.path, name, member)
+        if found is None:
+            return None
+        (filename, zip_member) = found
+
+        # The source modification time is part of the key, so updated models
+        # are converted again
+        try:
+            stat = await loop.run_in_executor(None, os.stat, filename)
+        except FileNotFoundError:
+            return None
+        key = (name if member is None else "%s/%s" % (name, member), stat.st_mtime_ns, format)
+
+        entry = await self.cache_get(key)
+        if entry is not None:
+            return entry
+
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(
+                self.convert(key, filename, zip_member, format))
+
+        return await asyncio.shield(self.pending[key])
+
+    async def convert(self, key, filename, member, format):
+        try:
+            loop = asyncio.get_event_loop()
+            data = await loop.run_in_executor(self.executor, convert_model, filename, member,
+                                              format, self.crease_angle)
+
+            entry = (data, hashlib.sha1(data).hexdigest())
+            await self.cache_put(key, entry)
+            return entry
+        finally:
+            del self.pending[key]
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+
+            # Skip the headers, only If-None-Match is used
+            if_none_match = set()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                (header, _, value) = line.decode('latin-1').partition(':')
+                if header.strip().lower() == 'if-none-match':
+                    if_none_match |= parse_etags(value)
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) != 3:
+                await self.respond(writer, 400, b'Bad Request')
+                return
+
+            (method, target, _) = parts
+            match = MODEL_PATH.match(target)
+            if method not in ('GET', 'HEAD'):
+                await self.respond(writer, 405, b'Method Not Allowed')
+                return
+            if match is None:
+                await self.respond(writer, 404, b'Not Found')
+                return
+
+            (name, member, format) = match.groups()
+            try:
+                entry = await self.get_model(name, format, member)
+            except Exception as e:
+                await self.respond(writer, 500, ("Conversion failed: %s" % e).encode('utf-8'))
+                return
+
+            if entry is None:
+                await self.respond(writer, 404, b'Not Found')
+                return
+
+            (data, etag) = entry
+            if etag in if_none_match or '*' in if_none_match:
+                await self.respond(writer, 304, b'', etag=etag)
+                return
+
+            await self.respond(writer, 200, data, FORMATS[format], etag=etag,
+                               body=method == 'GET')
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, data, content_type='text/plain', etag=None, body=True):
+        headers = [
+            "HTTP/1.1 %d %s" % (status, REASONS[status]),
+            "Connection: close",
+        ]
+        if status != 304:
+            headers.append("Content-Type: %s" % content_type)
+            headers.append("Content-Length: %d" % len(data))
+        if etag is not None:
+            headers.append('ETag: "%s"' % etag)
+
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1'))
+        if body and status != 304:
+            writer.write(data)
+
+        await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        # Start the workers before accepting connections, forked workers
+        # would otherwise inherit client sockets and hold them open
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, os.getpid)
+
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.executor.shutdown()
+
+def serve(path, host='127.0.0.1', port=8000, cache_path=None,
+          crease_angle=DEFAULT_CREASE_ANGLE):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    server = ModelServer(path, cache_path, crease_angle=crease_angle)
+    http = loop.run_until_complete(server.start(host, port))
+
+    print("Serving models from %s on http://%s:%d/models/" % (path, host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http.close()
+        loop.run_until_complete(http.wait_closed())
+        server.close()
+        loop.close()
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    crease_angle = DEFAULT_CREASE_ANGLE
+    for a in sys.argv[1:]:
+        if a.startswith('--crease='):
+            crease_angle = float(a[len('--crease='):])
+
+    serve(args[0],
+          port=int(args[1]) if len(args) > 1 else 8000,
+          cache_path=args[2] if len(args) > 2 else None,
+          crease_angle=crease_angle)
@@ -0,0 +1,158 @@
+import os, struct, json, hashlib, mmap
+
+MAGIC = b'AWMPACK\x01'
+
+# Index offset, index length, magic
+TRAILER = struct.Struct('<QQ8s')
+
+def read_index(data):
+    """
+    Returns (index, footer_end) for the last complete footer in the pack
+    contents data, or an empty index when no footer was written yet
+
+    Anything after that footer was left by an interrupted append and is
+    ignored.
+    """
+    if(data[:len(MAGIC)] != MAGIC):
+        raise Exception("Not a model pack file")
+
+    end = len(data)
+    while True:
+        pos = data.rfind(MAGIC, len(MAGIC), end)
+        if(pos < 0):
+            return ({}, len(MAGIC))
+
+        footer_end = pos + len(MAGIC)
+        trailer_start = footer_end - TRAILER.size
+        if(trailer_start >= len(MAGIC)):
+            index_offset, index_length, _ = TRAILER.unpack(data[trailer_start:footer_end])
+            if(index_offset + index_length == trailer_start):
+                try:
+                    index = json.loads(bytes(data[index_offset:trailer_start]).decode('utf-8'))
+                    return (index, footer_end)
+                except ValueError:
+                    pass
+
+        end = footer_end - 1
+
+class PackWriter:
+    """
+    Appends converted models to a single pack file with a footer index
+
+    Members are streamed to disk as they are added. The footer, a JSON
+    index of name -> (offset, length, sha1) followed by a fixed size
+    trailer, is written on close. Reopening an existing pack appends after
+    its last footer, which stays valid until the new one is complete, so an
+    interrupted run never loses members committed by earlier ones. Adding a
+    member whose content is already stored under that name is a no-op.
+    """
+
+    def __init__(self, filename):
+        self.index = {}
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.f = open(filename, 'r+b')
+            with mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                (self.index, end) = read_index(data)
+
+            # Drop whatever an interrupted append left after the last footer
+            self.f.seek(end)
+            self.f.truncate()
+        else:
+            self.f = open(filename, 'wb')
+            self.f.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, name, data):
+        digest = hashlib.sha1(data).hexdigest()
+        if name in self.index and self.index[name][2] == digest:
+            return
+
+        offset = self.f.tell()
+        self.f.write(data)
+
+        self.index[name] = [offset, len(data), digest]
+
+    def close(self):
+        if self.f.closed:
+            return
+
+        index = json.dumps(self.index, separators=(',',':')).encode('utf-8')
+        index_offset = self.f.tell()
+
+        self.f.write(index)
+        self.f.write(TRAILER.pack(index_offset, len(index), MAGIC))
+        self.f.close()
+
+class PackReader:
+    """
+    Memory-maps a pack file and returns zero-copy views of its members
+
+    Views returned by get() reference the mapping directly, so they must be
+    released before the reader is closed.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (self.index, _) = read_index(self.mmap)
+        self.view = memoryview(self.mmap)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return self.index.keys()
+
+    def get(self, name):
+        offset, length, _ = self.index[name]
+        return self.view[offset:offset+length]
+
+    def verify(self, name):
+        return hashlib.sha1(self.get(name)).hexdigest() == self.index[name][2]
+
+    def close(self):
+        if self.mmap.closed:
+            return
+
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A view returned by get() is still alive, stay usable so the
+            # caller can release it and close again
+            self.view = memoryview(self.mmap)
+            raise
+
+def compact(filename):
+    """
+    Rewrites a pack with only the members its index still references,
+    dropping replaced members and old footers
+    """
+    temp_filename = filename + ".tmp"
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+
+    with PackReader(filename) as reader:
+        with PackWriter(temp_filename) as writer:
+            for name in sorted(reader.names(), key=lambda n: reader.index[n][0]):
+                view = reader.get(name)
+                writer.add(name, view)
+                view.release()
+
+    os.replace(temp_filename, filename)
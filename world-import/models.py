@@ -1,29 +1,64 @@
-import os, glob
+import os, glob, time
 import zipfile
 
 from rwxreader import RwxReader
+from rwxscene import RwxScene
+from normals import DEFAULT_CREASE_ANGLE
 from rwxtothree import RwxToThree
+from modelpack import PackWriter
+from catalog import ModelCatalog
+
+def models_import(path, pack=None, catalog=None, crease_angle=DEFAULT_CREASE_ANGLE):
+    """
+    Converts every RWX model in the zips in path to Three.js JSON
+
+    Each model is written next to its zip, or appended to the pack file
+    named by pack when one is given. When catalog names an SQLite file,
+    per-model statistics are recorded in it as models are converted.
+    Normals are split at crease_angle degrees.
+    """
+    if pack is not None:
+        pack = os.path.abspath(pack)
+    if catalog is not None:
+        catalog = os.path.abspath(catalog)
 
-def models_import(path):
     os.chdir(path)
-    for file in glob.glob("*.zip"):
-        if zipfile.is_zipfile(file):
-            zf = zipfile.ZipFile(file)
 
-            try:
-                model_file = next(name for name in zf.namelist() if name.endswith(".rwx"))
-                model_name = os.path.splitext(model_file)[0]
+    pack_writer = PackWriter(pack) if pack is not None else None
+    model_catalog = ModelCatalog(catalog) if catalog is not None else None
+    try:
+        for file in glob.glob("*.zip"):
+            if zipfile.is_zipfile(file):
+                with zipfile.ZipFile(file) as zf:
+                    for model_file in [name for name in zf.namelist() if name.lower().endswith(".rwx")]:
+                        model_name = os.path.splitext(model_file)[0]
+
+                        print("Reading %s from zip" % model_file)
 
-                print("Reading %s from zip" % model_file)
+                        # Decompress the member into one buffer, which the
+                        # reader tokenizes in place
+                        data = zf.read(model_file)
 
-                f = zf.open(model_file)
-                try:
-                    rwx = RwxReader(f)
-                    three = RwxToThree(rwx.model)
+                        parse_start = time.perf_counter()
+                        rwx = RwxReader(data)
+                        convert_start = time.perf_counter()
+                        scene = RwxScene(rwx.model, crease_angle)
+                        three = RwxToThree(scene)
+                        convert_end = time.perf_counter()
 
-                    three.write_json(model_name + ".json")
-                finally:
-                    f.close()
+                        if pack_writer is not None:
+                            pack_writer.add(model_name + ".json",
+                                            three.to_json(compact=True).encode('utf-8'))
+                        else:
+                            three.write_json(model_name + ".json")
 
-            finally:
-                zf.close()
+                        if model_catalog is not None:
+                            model_catalog.update(model_name, scene,
+                                                 source=file,
+                                                 parse_time=convert_start - parse_start,
+                                                 convert_time=convert_end - convert_start)
+    finally:
+        if pack_writer is not None:
+            pack_writer.close()
+        if model_catalog is not None:
+            model_catalog.close()
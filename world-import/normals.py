@@ -0,0 +1,149 @@
+import math
+import numpy
+
+DEFAULT_CREASE_ANGLE = 60.0
+
+# Corner pairs evaluated at once by generate_normals
+PAIR_CHUNK_SIZE = 1 << 18
+
+# Vertices with more corner groups than this are not paired exhaustively
+PAIR_GROUP_LIMIT = 1024
+
+def normalize(vectors, fallback=(0.0, 1.0, 0.0)):
+    """
+    Scales rows of vectors to unit length, replacing zero length rows with
+    fallback
+    """
+    lengths = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    result = numpy.where(lengths > 0, vectors / numpy.where(lengths > 0, lengths, 1.0), 0.0)
+    result[lengths[:, 0] == 0] = fallback
+
+    return result
+
+def generate_normals(positions, indices, crease_angle=DEFAULT_CREASE_ANGLE,
+                     chunk_size=PAIR_CHUNK_SIZE, group_limit=PAIR_GROUP_LIMIT):
+    """
+    Computes smooth vertex normals for a triangle mesh
+
+    Face normals are accumulated with area weighting. A face only
+    contributes to a corner when it is within crease_angle degrees of the
+    corner's own face, and vertices are split wherever their corners end up
+    with different normals. Pairs of corner groups are evaluated chunk_size
+    at a time.
+
+    Comparing every face of a vertex with every other one is quadratic in
+    its valence. Vertices whose faces all lie within half the crease angle
+    of their mean normal are smooth throughout and skip the comparison.
+    Vertices with more than group_limit differently facing faces that do
+    not are approximated in linear time: faces within the crease angle of
+    the mean normal share one smooth normal and the others stay flat.
+
+    Returns (vertex_map, indices, normals): vertex_map holds the source
+    vertex for every output vertex, so other per-vertex attributes can be
+    remapped with attribute[vertex_map].
+    """
+    if(len(indices) == 0):
+        return (numpy.arange(len(positions)),
+                indices,
+                numpy.zeros((len(positions), 3)))
+
+    positions = positions.astype("float64")
+    triangles = positions[indices]
+
+    # Cross product length is twice the face area, which gives area weighting
+    face_normals = numpy.cross(triangles[:, 1] - triangles[:, 0],
+                               triangles[:, 2] - triangles[:, 0])
+    face_units = normalize(face_normals, fallback=(0.0, 0.0, 0.0))
+
+    corner_vertices = indices.reshape(-1).astype("intp")
+    corner_faces = numpy.repeat(numpy.arange(len(indices)), 3)
+
+    # Corners of one vertex whose faces face the same way always end up with
+    # the same normal, so they are merged into one bucket first. This keeps
+    # flat polygon fans linear however many triangles share their centre.
+    (_, bucket_corners, corner_buckets) = numpy.unique(
+        numpy.column_stack((corner_vertices, face_units[corner_faces])),
+        axis=0, return_index=True, return_inverse=True)
+    corner_buckets = corner_buckets.reshape(-1)
+
+    bucket_vertices = corner_vertices[bucket_corners]
+    bucket_units = face_units[corner_faces[bucket_corners]]
+    bucket_normals = numpy.zeros((len(bucket_corners), 3))
+    numpy.add.at(bucket_normals, corner_buckets, face_normals[corner_faces])
+
+    # Buckets are sorted by vertex, each vertex's buckets form a group
+    group_starts = numpy.flatnonzero(numpy.r_[True, bucket_vertices[1:] != bucket_vertices[:-1]])
+    group_sizes = numpy.diff(numpy.r_[group_starts, len(bucket_vertices)])
+    bucket_groups = numpy.repeat(numpy.arange(len(group_starts)), group_sizes)
+
+    cos_crease = math.cos(math.radians(crease_angle))
+    sums = numpy.empty((len(bucket_vertices), 3))
+
+    # Two faces within half the crease angle of the mean are within the
+    # crease angle of each other, so such a vertex is smooth throughout.
+    # Degenerate faces have no direction and follow their vertex.
+    group_sums = numpy.add.reduceat(bucket_normals, group_starts)
+    mean_cos = numpy.einsum('ij,ij->i', bucket_units,
+                            normalize(group_sums, fallback=(0.0, 0.0, 0.0))[bucket_groups])
+    degenerate = ~bucket_units.any(axis=1)
+    smooth_groups = numpy.logical_and.reduceat(
+        (mean_cos >= math.cos(math.radians(crease_angle / 2))) | degenerate, group_starts)
+
+    selected = smooth_groups[bucket_groups]
+    sums[selected] = group_sums[bucket_groups[selected]]
+
+    # Only the faces close enough to the mean are smoothed on vertices too
+    # large to pair
+    large_groups = ~smooth_groups & (group_sizes > group_limit)
+    selected = large_groups[bucket_groups]
+    close = (mean_cos >= cos_crease) | degenerate
+    close_sums = numpy.add.reduceat(bucket_normals * close[:, None], group_starts)
+    sums[selected] = numpy.where(close[selected, None],
+                                 close_sums[bucket_groups[selected]],
+                                 bucket_normals[selected])
+
+    # The remaining buckets are paired with each bucket of the same vertex,
+    # including itself
+    paired = numpy.flatnonzero(~(smooth_groups | large_groups)[bucket_groups])
+    bucket_group_size = group_sizes[bucket_groups[paired]]
+    bucket_group_start = group_starts[bucket_groups[paired]]
+    pair_ends = numpy.cumsum(bucket_group_size)
+
+    # A vertex with k buckets makes k * k pairs, so pairs are evaluated a
+    # chunk of buckets at a time to keep memory bounded on high valence
+    # vertices such as the tip of a finely divided cone
+    start = 0
+    while(start < len(paired)):
+        pairs_before = pair_ends[start] - bucket_group_size[start]
+        end = max(int(numpy.searchsorted(pair_ends, pairs_before + chunk_size, side='right')),
+                  start + 1)
+
+        sizes = bucket_group_size[start:end]
+        row_starts = numpy.cumsum(sizes) - sizes
+
+        pair_first = numpy.repeat(paired[start:end], sizes)
+        pair_offsets = numpy.arange(len(pair_first)) - numpy.repeat(row_starts, sizes)
+        pair_second = numpy.repeat(bucket_group_start[start:end], sizes) + pair_offsets
+
+        smooth = numpy.einsum('ij,ij->i', bucket_units[pair_first],
+                              bucket_units[pair_second]) >= cos_crease
+        smooth |= pair_first == pair_second
+
+        # Every bucket pairs with itself, so no row is empty
+        sums[paired[start:end]] = numpy.add.reduceat(
+            bucket_normals[pair_second] * smooth[:, None], row_starts)
+
+        start = end
+
+    corner_normals = normalize(sums)[corner_buckets]
+
+    # Corners of one vertex that share a normal share an output vertex
+    keys = numpy.column_stack((corner_vertices, corner_normals))
+    (_, first_corners, corner_outputs) = numpy.unique(
+        keys, axis=0, return_index=True, return_inverse=True)
+
+    vertex_map = corner_vertices[first_corners]
+    normals = corner_normals[first_corners]
+    new_indices = corner_outputs.reshape(-1, 3).astype(indices.dtype)
+
+    return (vertex_map, new_indices, normals)
@@ -1,62 +1,89 @@
+import re
+
+LINE_PATTERN = re.compile(rb'[^\r\n]+')
+
 def dirty_float(x):
     try:
         return float(x)
     except ValueError:
-        if(x[-1] == '.'):
+        if(x.endswith(b'.')):
             return float(x[:-1])
 
 class RwxReader:
     """
     Parses ActiveWorlds RWX files into a dictionary
+
+    Takes a bytes-like buffer (bytes, memoryview, mmap, a decompressed zip
+    member...) and tokenizes it in place, or a file object, which is read
+    into one buffer first.
     """
 
-    SKIP_KEYWORDS = (
-        "texturemodes",
-        "texturemode",
-        "addtexturemode",
-        "removetexturemode",
-        "addmaterialmode",
-        "removematerialmode",
-        "opacityfix",
-        "lightsampling",
-        "geometrysampling",
-        "materialmodes",
-        "addhint",
-        "hints",
-        "axisalignment",
-        "sphere",
-        "box",
-        "texturemipmapstate",
-    )
-
-    protos = {}
-
-    def __init__(self, f):
-        self.token_gen = self.file_generator(f)
-
-        self.read_rwx()
+    SKIP_KEYWORDS = frozenset((
+        b"texturemodes",
+        b"texturemode",
+        b"addtexturemode",
+        b"removetexturemode",
+        b"addmaterialmode",
+        b"removematerialmode",
+        b"opacityfix",
+        b"lightsampling",
+        b"geometrysampling",
+        b"materialmodes",
+        b"addhint",
+        b"hints",
+        b"axisalignment",
+        b"sphere",
+        b"box",
+        b"texturemipmapstate",
+    ))
+
+    def __init__(self, source):
+        if hasattr(source, 'read'):
+            source = source.read()
+        if isinstance(source, str):
+            source = source.encode('latin-1')
+
+        self.buffer = source
+        self.offset = 0
+        self.protos = {}
+
+        self.token_gen = self.buffer_generator(source)
+
+        try:
+            self.read_rwx()
+        finally:
+            # Drop the tokenizer so callers can release the buffer
+            self.token_gen = None
+            self.buffer = None
 
     def read_line(self):
         return next(self.token_gen, None)
 
-    def file_generator(self, f):
-        for line_no, line in enumerate([l.strip() for l in f]):
-            if(line.startswith("#")):
-                continue
+    def line_position(self):
+        """
+        Returns (line number, line text) of the line being parsed, for errors
+        """
+        head = bytes(memoryview(self.buffer)[:self.offset])
+        match = LINE_PATTERN.match(self.buffer, self.offset)
 
-            self.line_no = line_no
-            self.full_line = line
+        return (head.count(b'\n') + 1,
+                match.group().strip().decode('latin-1') if match else '')
 
-            if "#" in line:
-                line = line[:line.index("#")].strip()
+    def buffer_generator(self, buffer):
+        for match in LINE_PATTERN.finditer(buffer):
+            line = match.group()
+
+            if b"#" in line:
+                line = line[:line.index(b"#")]
 
             line = line.strip().lower()
             line_split = line.split()
-            
-            if(len(line_split) <= 0 or
-               any([line_split[0] == k for k in self.SKIP_KEYWORDS])):
+
+            if(len(line_split) <= 0 or line_split[0] in self.SKIP_KEYWORDS):
                 continue
 
+            self.offset = match.start()
+
             yield (line, line_split)
 
     def proto_generator(self, proto_name, file_generator):
@@ -67,7 +94,7 @@ class RwxReader:
 
     def apply_protoinstance(self, proto_name):
         if proto_name not in self.protos:
-            raise Exception("Unrecognized proto %s" % proto_name)
+            raise Exception("Unrecognized proto %s" % proto_name.decode('latin-1'))
 
         self.token_gen = self.proto_generator(proto_name, self.token_gen)
 
@@ -77,13 +104,13 @@ class RwxReader:
         proto_lines = []
         
         line, line_split = self.read_line()
-        while(line_split[0] != "protoend"):
+        while(line_split[0] != b"protoend"):
             proto_lines.append((line, line_split,))
             line, line_split = self.read_line()
 
         self.protos[name] = proto_lines
 
-    def read_clump(self, end_token="clumpend"):
+    def read_clump(self, end_token=b"clumpend"):
         clump = {
             'transforms': [],
             'materials': [],
@@ -96,7 +123,7 @@ class RwxReader:
         line, line_split = self.read_line()
 
         while(line_split[0] != end_token):
-            if(line_split[0] == "vertex" or line_split[0] == "vertexext"):
+            if(line_split[0] == b"vertex" or line_split[0] == b"vertexext"):
                 vertex = {
                     'x': dirty_float(line_split[1]),
                     'y': dirty_float(line_split[2]),
@@ -106,7 +133,7 @@ class RwxReader:
                 
                 i = 4
                 while(i < len(line_split)):
-                    if(line_split[i] == "uv"):
+                    if(line_split[i] == b"uv"):
                         vertex['u'] = dirty_float(line_split[i+1])
                         vertex['v'] = dirty_float(line_split[i+2])
                         i += 3
@@ -114,30 +141,30 @@ class RwxReader:
                         i += 1 # TODO: Do this right
                 clump['vertices'].append(vertex)
 
-            elif(line_split[0] == "triangle" or line_split[0] == "triangleext"):
+            elif(line_split[0] == b"triangle" or line_split[0] == b"triangleext"):
                 clump['triangles'].append({
                     'indices': [int(line_split[1]),
                                 int(line_split[2]),
                                 int(line_split[3]),],
                     'material': len(clump['materials']),
-                    'tag': line_split[-1] if line_split[-2] == "tag" else 0
+                    'tag': int(line_split[-1]) if line_split[-2] == b"tag" else 0
                 })
 
-            elif(line_split[0] == "quad" or line_split[0] == "quadext"):
+            elif(line_split[0] == b"quad" or line_split[0] == b"quadext"):
                 indices = [int(x) for x in line_split[1:5]]
 
                 clump['triangles'].append({
                     'indices': [indices[0], indices[1], indices[2]],
                     'material': len(clump['materials']),
-                    'tag': line_split[-1] if line_split[-2] == "tag" else 0
+                    'tag': int(line_split[-1]) if line_split[-2] == b"tag" else 0
                 })
                 clump['triangles'].append({
                     'indices': [indices[0], indices[2], indices[3]],
                     'material': len(clump['materials']),
-                    'tag': line_split[-1] if line_split[-2] == "tag" else 0
+                    'tag': int(line_split[-1]) if line_split[-2] == b"tag" else 0
                 })
 
-            elif(line_split[0] == "polygon"):
+            elif(line_split[0] == b"polygon"):
                 count = int(line_split[1])
 
                 indices = [int(line_split[i]) for i in range(2, count+2)]
@@ -146,37 +173,38 @@ class RwxReader:
                     clump['triangles'].append({
                         'indices': [indices[0], indices[i], indices[i+1]],
                         'material': len(clump['materials']),
-                        'tag': line_split[-1] if line_split[-2] == "tag" else 0
+                        'tag': int(line_split[-1]) if line_split[-2] == b"tag" else 0
                     })
                     
-            elif(line_split[0] == "surface"):
+            elif(line_split[0] == b"surface"):
                 clump['materials'].append({
                     'type': 'surface',
                     'ambient': dirty_float(line_split[1]),
                     'diffuse': dirty_float(line_split[2]),
                     'specular': dirty_float(line_split[3])
                 })
-            elif(line_split[0] == "texture"):
+            elif(line_split[0] == b"texture"):
                 clump['materials'].append({
                     'type': 'texture',
-                    'texture': line_split[1] if line_split[1] != 'null' else None
+                    'texture': line_split[1].decode('latin-1') if line_split[1] != b'null' else None
                 })
-            elif(line_split[0] == "color"):
+            elif(line_split[0] == b"color"):
                 clump['materials'].append({
                     'type': 'color',
                     'r': dirty_float(line_split[1]),
                     'g': dirty_float(line_split[2]),
                     'b': dirty_float(line_split[3])
                 })
-            elif(any(line_split[0] == s for s in ("ambient", "diffuse", "specular", "opacity"))):
+            elif(line_split[0] in (b"ambient", b"diffuse", b"specular", b"opacity")):
+                material_type = line_split[0].decode('ascii')
                 clump['materials'].append({
-                    'type': line_split[0],
-                    line_split[0]: dirty_float(line_split[1])
+                    'type': material_type,
+                    material_type: dirty_float(line_split[1])
                 })
-            elif(line_split[0] == "tag"):
+            elif(line_split[0] == b"tag"):
                 clump['tag'] = int(line_split[1])
 
-            elif(line_split[0] == "rotate"):
+            elif(line_split[0] == b"rotate"):
                 clump['transforms'].append({
                     'type': 'rotate',
                     'x': dirty_float(line_split[1]),
@@ -184,45 +212,46 @@ class RwxReader:
                     'z': dirty_float(line_split[3]),
                     'angle': dirty_float(line_split[4])
                 })
-            elif(line_split[0] == "scale"):
+            elif(line_split[0] == b"scale"):
                 clump['transforms'].append({
                     'type': 'scale',
                     'x': dirty_float(line_split[1]),
                     'y': dirty_float(line_split[2]),
                     'z': dirty_float(line_split[3]),
                 })
-            elif(line_split[0] == "translate"):
+            elif(line_split[0] == b"translate"):
                 clump['transforms'].append({
                     'type': 'translate',
                     'x': dirty_float(line_split[1]),
                     'y': dirty_float(line_split[2]),
                     'z': dirty_float(line_split[3]),
                 })
-            elif(line_split[0] == "transform" or line_split[0] == "transformjoint"):
+            elif(line_split[0] == b"transform" or line_split[0] == b"transformjoint"):
                 clump['transforms'].append({
                     'type': 'transform',
                     'matrix': [dirty_float(x) for x in line_split[1:17]]
                 })
-            elif(line_split[0] == "identity" or line_split[0] == "identityjoint"):
+            elif(line_split[0] == b"identity" or line_split[0] == b"identityjoint"):
                 clump['transforms'].append({
                     'type': 'identity'
                 })
 
-            elif(line_split[0] == "protobegin"):
+            elif(line_split[0] == b"protobegin"):
                 self.read_proto(line)
-            elif(line_split[0] == "protoinstance"):
+            elif(line_split[0] == b"protoinstance"):
                 self.apply_protoinstance(line_split[1])
 
-            elif(any(line_split[0] == s for s in
-                     ("clumpbegin", "transformbegin", "jointtransformbegin",))):
+            elif(line_split[0] in (b"clumpbegin", b"transformbegin", b"jointtransformbegin",)):
                 type = line_split[0][:-5]
                 clump['children'].append({
-                    'type': type,
+                    'type': type.decode('ascii'),
                     'transform': len(clump['transforms']),
-                    'clump': self.read_clump(type + "end")
+                    'material': len(clump['materials']),
+                    'clump': self.read_clump(type + b"end")
                 })
             else:
-                raise Exception("Unexpected %s, line %d\n%s" % (line_split[0], self.line_no, self.full_line))
+                (line_no, full_line) = self.line_position()
+                raise Exception("Unexpected %s, line %d\n%s" % (line_split[0].decode('latin-1'), line_no, full_line))
 
             line, line_split = self.read_line()
 
@@ -231,5 +260,5 @@ class RwxReader:
     def read_rwx(self):
         line, line_split = self.read_line()
 
-        if(line_split[0] == "modelbegin" or line_split[0] == "clumpbegin"):
-            self.model = self.read_clump(line_split[0][:-5] + "end")
+        if(line_split[0] == b"modelbegin" or line_split[0] == b"clumpbegin"):
+            self.model = self.read_clump(line_split[0][:-5] + b"end")
@@ -0,0 +1,220 @@
+import math
+import numpy
+
+from normals import generate_normals, DEFAULT_CREASE_ANGLE
+
+DEFAULT_MATERIAL = {
+    'color': (0.0, 0.0, 0.0),
+    'ambient': 0.0,
+    'diffuse': 0.0,
+    'specular': 0.0,
+    'opacity': 1.0,
+    'texture': None,
+}
+
+def transform_matrix(transform, base_matrix, previous_matrix):
+    """
+    Returns the matrix stack entry produced by applying a parsed RWX
+    transform on top of previous_matrix
+    """
+    if(transform['type'] == "transform"):
+        matrix = numpy.array(transform['matrix']).reshape(4, 4)
+
+    elif(transform['type'] == "identity"):
+        return base_matrix
+
+    elif(transform['type'] == "scale"):
+        matrix = numpy.identity(4)
+        matrix[0, 0] = transform['x']
+        matrix[1, 1] = transform['y']
+        matrix[2, 2] = transform['z']
+
+    elif(transform['type'] == "translate"):
+        matrix = numpy.identity(4)
+        matrix[3, :3] = [transform['x'], transform['y'], transform['z']]
+
+    elif(transform['type'] == "rotate"):
+        x, y, z, rad = (transform['x'], transform['y'], transform['z'],
+                        math.radians(transform['angle']))
+        length = 1 / math.sqrt(x*x + y*y + z*z)
+        x = x * length
+        y = y * length
+        z = z * length
+
+        s = math.sin(rad)
+        c = math.cos(rad)
+        t = 1 - c
+
+        matrix = numpy.array([[x * x * t + c,
+                               y * x * t + z * s,
+                               z * x * t - y * s,
+                               0.0],
+                              [x * y * t - z * s,
+                               y * y * t + c,
+                               z * y * t + x * s,
+                               0.0],
+                              [x * z * t + y * s,
+                               y * z * t - x * s,
+                               z * z * t + c,
+                               0.0],
+                              [0.0, 0.0, 0.0, 1.0]])
+
+    else:
+        raise Exception("Unexpected transform %s" % transform['type'])
+
+    return numpy.dot(matrix, previous_matrix)
+
+def apply_material(state, rwx_material):
+    """
+    Returns a copy of a resolved material state with one parsed RWX
+    material command applied
+    """
+    state = dict(state)
+
+    if(rwx_material['type'] == 'surface'):
+        state['ambient'] = rwx_material['ambient']
+        state['diffuse'] = rwx_material['diffuse']
+        state['specular'] = rwx_material['specular']
+    elif(rwx_material['type'] == 'color'):
+        state['color'] = (rwx_material['r'],
+                          rwx_material['g'],
+                          rwx_material['b'])
+    elif(any([rwx_material['type'] == s for s in ("ambient", "diffuse", "specular", "opacity",)])):
+        state[rwx_material['type']] = rwx_material[rwx_material['type']]
+    elif(rwx_material['type'] == "texture"):
+        state['texture'] = rwx_material['texture']
+
+    return state
+
+def tag_runs(tags):
+    """
+    Returns (tag, start, count) for every run of equal, non-zero tags in an
+    array of per-triangle tags
+    """
+    if(len(tags) == 0):
+        return []
+
+    starts = numpy.flatnonzero(numpy.r_[True, tags[1:] != tags[:-1]])
+    counts = numpy.diff(numpy.r_[starts, len(tags)])
+
+    return [(int(tags[start]), int(start), int(count))
+            for (start, count) in zip(starts, counts) if tags[start] != 0]
+
+class RwxScene:
+    """
+    Compiles a parsed RWX model into resolved geometry shared by the exporters
+
+    Transforms are baked into the vertex positions, material commands are
+    folded into deduplicated material states and every clump's geometry is
+    stored as typed numpy arrays, so each exporter only has to serialize.
+    Vertex normals are generated with splits at crease_angle degrees.
+
+    Triangles are sorted by (material, tag) so every tagged surface is a
+    contiguous range. A triangle without a tag of its own takes its clump's.
+
+    """
+
+    def __init__(self, rwx, crease_angle=DEFAULT_CREASE_ANGLE):
+        self.rwx = rwx
+        self.crease_angle = crease_angle
+
+        self.materials = []
+        self.material_indices = {}
+
+        self.root = self.compile(rwx)
+
+    def add_material(self, state):
+        key = tuple(sorted(state.items()))
+
+        if key not in self.material_indices:
+            self.material_indices[key] = len(self.materials)
+            self.materials.append(state)
+
+        return self.material_indices[key]
+
+    def iter_clumps(self, clump=None):
+        if(clump is None):
+            clump = self.root
+
+        yield clump
+
+        for child in clump['children']:
+            yield from self.iter_clumps(child)
+
+    def bounds(self):
+        """
+        Returns the (min, max) corners of the baked geometry, or None when
+        the model has no vertices
+        """
+        positions = numpy.concatenate([c['positions'] for c in self.iter_clumps()])
+        if(len(positions) == 0):
+            return None
+
+        return (positions.min(axis=0), positions.max(axis=0))
+
+    def compile(self, rwx, base_matrix=None, base_material=None, depth=0):
+        if(base_matrix is None):
+            base_matrix = numpy.identity(4)
+
+        if(base_material is None):
+            base_material = DEFAULT_MATERIAL
+
+        matrix_stack = [base_matrix,]
+        for transform in rwx.get('transforms', []):
+            matrix_stack.append(transform_matrix(transform, base_matrix, matrix_stack[-1]))
+
+        material_stack = [base_material,]
+        for rwx_material in rwx.get('materials', []):
+            material_stack.append(apply_material(material_stack[-1], rwx_material))
+
+        vertices = rwx.get('vertices', [])
+        positions = numpy.array([[v['x'], v['y'], v['z'], 1.0] for v in vertices],
+                                dtype="float64").reshape(-1, 4)
+        vertex_transforms = numpy.array([v['transform'] for v in vertices], dtype="intp")
+
+        # Bake each vertex through the matrix that was current when it was read
+        positions = numpy.einsum('ni,nij->nj', positions,
+                                 numpy.array(matrix_stack)[vertex_transforms])
+
+        uvs = numpy.array([[v.get('u', 0.0), v.get('v', 0.0)] for v in vertices],
+                          dtype="float64").reshape(-1, 2)
+        has_uvs = numpy.array(['v' in v for v in vertices], dtype="bool")
+
+        triangles = rwx.get('triangles', [])
+        material_ids = {}
+        for m in set(t['material'] for t in triangles):
+            material_ids[m] = self.add_material(material_stack[m])
+
+        indices = numpy.array([t['indices'] for t in triangles], dtype="uint32").reshape(-1, 3) - 1
+        (vertex_map, indices, normals) = generate_normals(positions[:, :3], indices,
+                                                          self.crease_angle)
+
+        clump_tag = int(rwx.get('tag', 0))
+        materials = numpy.array([material_ids[t['material']] for t in triangles], dtype="uint32")
+        tags = numpy.array([int(t['tag']) for t in triangles], dtype="int32")
+        tags[tags == 0] = clump_tag
+
+        order = numpy.lexsort((tags, materials))
+
+        clump = {
+            'depth': depth,
+            'tag': clump_tag,
+            'source_vertices': len(vertices),
+            'positions': positions[vertex_map, :3],
+            'uvs': uvs[vertex_map],
+            'has_uvs': has_uvs[vertex_map],
+            'normals': normals,
+            'indices': indices[order],
+            'materials': materials[order],
+            'tags': tags[order],
+            'children': [],
+        }
+
+        for child in rwx.get('children', []):
+            clump['children'].append(self.compile(
+                child['clump'],
+                matrix_stack[child['transform']],
+                material_stack[child.get('material', len(material_stack)-1)],
+                depth+1))
+
+        return clump
@@ -1,39 +1,73 @@
-import sys, os.path
+import sys, os.path, mmap
 import pygltflib, numpy as np
-from functools import reduce
+
+from rwxscene import RwxScene, tag_runs
+from normals import normalize, DEFAULT_CREASE_ANGLE
+
+TEXTURE_FILE_FORMAT = "%s.png"
 
 class RwxToGltf():
   """
   Converts parsed RWX models to GLTF
+
+  With quantize set, vertex attributes are stored as normalized integers
+  following KHR_mesh_quantization and the largest dequantization error of
+  each attribute is reported in quantization_error. Texture coordinates
+  outside [0, 1], as on tiled textures, are stored relative to the model's
+  UV range and textured materials carry the KHR_texture_transform that maps
+  them back.
+
+  Normals of a parsed model are split at crease_angle degrees, an already
+  compiled RwxScene keeps its own.
   """
 
-  def __init__(self, rwx):
+  def __init__(self, rwx, quantize=False, crease_angle=DEFAULT_CREASE_ANGLE):
+    if not isinstance(rwx, RwxScene):
+      rwx = RwxScene(rwx, crease_angle)
+
     self.rwx = rwx
 
     self.buffer = b''
     self.bufferViews = []
     self.accessors = []
     self.materials = []
-    self.material_dicts = []
+    self.textures = []
+    self.images = []
     self.meshes = []
     self.nodes = []
+    self.extensions = set()
+    self.tags = {}
+
+    self.quantize = quantize
+    self.quantization_error = {}
+    self.uv_transform = None
 
     self.root_node = self.convert(self.rwx)
 
-  def save(self, filename):
+  def to_gltf(self):
     gltf = pygltflib.GLTF2(
       scene=0,
-      scenes=[pygltflib.Scene(nodes=[self.root_node])],
+      scenes=[pygltflib.Scene(nodes=[self.root_node], extras={"tags": self.tags})],
       nodes=self.nodes,
       materials=self.materials,
+      textures=self.textures,
+      images=self.images,
       meshes=self.meshes,
       buffers=[pygltflib.Buffer(byteLength=len(self.buffer))],
       bufferViews=self.bufferViews,
-      accessors=self.accessors
+      accessors=self.accessors,
+      extensionsUsed=sorted(self.extensions),
+      extensionsRequired=sorted(self.extensions)
     )
     gltf.set_binary_blob(self.buffer)
     gltf.convert_buffers(pygltflib.BufferFormat.DATAURI)
-    gltf.save_json(filename)
+    return gltf
+
+  def to_json(self):
+    return self.to_gltf().gltf_to_json(separators=(',',':'), indent=None)
+
+  def save(self, filename):
+    self.to_gltf().save_json(filename)
 
   def add_to_buffer(self, data):
     offset = len(self.buffer)
@@ -48,133 +82,221 @@ class RwxToGltf():
 
     return (offset, length)
 
-  def add_to_material(self, materials):
-    material = {
-      "r": 0.5,
-      "g": 0.5,
-      "b": 0.5,
-      "a": 1.0,
-      "metallic": 1.0,
-      "roughness": 0.0
+  def add_material(self, material):
+    # Quick and dirty conversion...
+    pbr = {
+      "baseColorFactor": list(material['color']) + [material['opacity']],
+      "metallicFactor": material['diffuse'],
+      "roughnessFactor": material['specular'],
     }
-    for m in materials:
-      if(m['type'] == 'color'):
-        material['r'] = m['r']
-        material['g'] = m['g']
-        material['b'] = m['b']
-      elif(m['type'] == "surface"):
-        # Quick and dirty conversion...
-        material['metallic'] = m['diffuse']
-        material['roughness'] = m['specular']
-      elif(m['type'] == "opacity"):
-        material['a'] = m['opacity']
-      elif(m['type'] == "texture"):
-        material['texture'] = m['texture']
-
-    # See if material exists already
-    for (i, m) in enumerate(self.material_dicts):
-      if material == m:
-        return i
-
-    # Create new one
-    result = len(self.materials)
-    self.material_dicts.append(material)
+
+    if(material['texture'] is not None):
+      self.images.append(pygltflib.Image(uri=TEXTURE_FILE_FORMAT % material['texture']))
+      self.textures.append(pygltflib.Texture(source=len(self.images) - 1))
+      pbr["baseColorTexture"] = {"index": len(self.textures) - 1}
+
+      if(self.uv_transform is not None):
+        (offset, scale) = self.uv_transform
+        pbr["baseColorTexture"]["extensions"] = {
+          "KHR_texture_transform": {"offset": offset.tolist(), "scale": scale.tolist()}
+        }
+        self.extensions.add("KHR_texture_transform")
+
     self.materials.append(pygltflib.Material(
-      pbrMetallicRoughness={
-        "baseColorFactor": [material['r'], material['g'], material['b'], material['a']],
-        "metallicFactor": material['metallic'],
-        "roughnessFactor": material['roughness'],
-      },
+      pbrMetallicRoughness=pbr,
       alphaCutoff=None
     ))
-    return result
 
-  def convert(self, rwx):
+  def convert(self, scene):
+    if self.quantize:
+      # Quantized texture coordinates are stored relative to the UV range of
+      # the whole model, so meshes sharing a material share its transform
+      uvs = np.concatenate([c['uvs'] for c in scene.iter_clumps() if len(c['indices']) > 0])
+      if(len(uvs) > 0 and (uvs.min() < 0 or uvs.max() > 1)):
+        offset = uvs.min(axis=0)
+        scale = uvs.max(axis=0) - offset
+        scale[scale == 0] = 1.0
+        self.uv_transform = (offset, scale)
+
+    for material in scene.materials:
+      self.add_material(material)
+
+    return self.convert_clump(scene.root)
+
+  def add_buffer_view(self, data, target, byte_stride=None):
+    (offset, length) = self.add_to_buffer(data.tobytes())
+    self.bufferViews.append(pygltflib.BufferView(
+      buffer=0,
+      byteOffset=offset,
+      byteLength=length,
+      byteStride=byte_stride,
+      target=target
+    ))
+
+    return len(self.bufferViews) - 1
+
+  def add_attribute(self, data, quantized=None):
+    """
+    Adds a float vertex attribute, optionally quantized to the
+    (dtype, componentType) pair given
+
+    Quantized attributes are stored normalized, so data must already be
+    scaled into the dtype's normalized range. Returns the accessor index and
+    the values a client will read back.
+    """
+    count, width = data.shape
+
+    if quantized is None:
+      stored = data.astype("float32")
+      component_type = pygltflib.FLOAT
+    else:
+      (dtype, component_type) = quantized
+      limit = np.iinfo(dtype).max
+      stored = np.round(data * limit).astype(dtype)
+
+    # Vertex attribute elements need to be 4 byte aligned
+    padding = (-stored.itemsize * width) % 4 // stored.itemsize
+    padded = np.pad(stored, ((0, 0), (0, padding)))
+
+    self.accessors.append(pygltflib.Accessor(
+      bufferView=self.add_buffer_view(
+        padded, pygltflib.ARRAY_BUFFER,
+        padded.itemsize * padded.shape[1] if padding > 0 else None),
+      componentType=component_type,
+      normalized=quantized is not None,
+      count=count,
+      type={2: pygltflib.VEC2, 3: pygltflib.VEC3}[width],
+      max=stored.max(axis=0).tolist(),
+      min=stored.min(axis=0).tolist()
+    ))
+
+    if quantized is not None:
+      decoded = stored / limit
+    else:
+      decoded = stored
+
+    return (len(self.accessors) - 1, decoded)
+
+  def add_indices(self, triangles):
+    max_index = int(triangles.max())
+    if(max_index < 255):
+      index_data = triangles.astype("uint8")
+      component_type = pygltflib.UNSIGNED_BYTE
+    elif(max_index < 65535):
+      index_data = triangles.astype("uint16")
+      component_type = pygltflib.UNSIGNED_SHORT
+    else:
+      index_data = triangles.astype("uint32")
+      component_type = pygltflib.UNSIGNED_INT
+
+    self.accessors.append(pygltflib.Accessor(
+      bufferView=self.add_buffer_view(index_data, pygltflib.ELEMENT_ARRAY_BUFFER),
+      componentType=component_type,
+      count=index_data.size,
+      type=pygltflib.SCALAR,
+      min=[int(index_data.min())],
+      max=[max_index]
+    ))
+
+    return len(self.accessors) - 1
+
+  def report_error(self, attribute, data, decoded):
+    error = float(np.abs(decoded - data).max())
+    self.quantization_error[attribute] = max(error, self.quantization_error.get(attribute, 0.0))
+
+  def convert_clump(self, clump):
     node_index = len(self.nodes)
     node = pygltflib.Node()
     self.nodes.append(node)
 
-    if 'transforms' in rwx and len(rwx['transforms']) > 0:
-      for transform in rwx['transforms']:
-        if(transform['type'] == "transform"):
-          node.matrix = transform['matrix']
-
-    if 'vertices' in rwx and 'triangles' in rwx and len(rwx['vertices']) > 0 and len(['triangles']) > 0:
-      vertex_data = np.array([[v['x'], v['y'], v['z']] for v in rwx['vertices']], dtype="float32")
-      
-      points_accessor = len(self.accessors)
-      self.accessors.append(pygltflib.Accessor(
-        bufferView=len(self.bufferViews),
-        componentType=pygltflib.FLOAT,
-        count=len(vertex_data),
-        type=pygltflib.VEC3,
-        max=vertex_data.max(axis=0).tolist(),
-        min=vertex_data.min(axis=0).tolist()
-      ))
-
-      (vertex_offset, vertex_length) = self.add_to_buffer(vertex_data.flatten().tobytes())
-      self.bufferViews.append(pygltflib.BufferView(
-        buffer=0,
-        byteOffset=vertex_offset,
-        byteLength=vertex_length,
-        target=pygltflib.ARRAY_BUFFER
-      ))
-      
-      grouped_triangles = {}
-      for triangle in rwx['triangles']:
-        if triangle['material'] in grouped_triangles:
-          grouped_triangles[triangle['material']].append(triangle['indices'])
-        else:
-          grouped_triangles[triangle['material']] = [triangle['indices']]
+    if len(clump['positions']) > 0 and len(clump['indices']) > 0:
+      positions = clump['positions'].astype("float64")
+      uvs = clump['uvs'].astype("float64")
+      normals = clump['normals'].astype("float64")
 
-      primitives = []
-      for (material, triangles) in grouped_triangles.items():
-        short_indices = np.array(triangles).flatten().max() < 255
-        index_data = np.array(triangles, dtype="uint8" if short_indices else "uint16")-1
-
-        index_accessor = len(self.accessors)
-        self.accessors.append(pygltflib.Accessor(
-          bufferView=len(self.bufferViews),
-          componentType=pygltflib.UNSIGNED_BYTE if short_indices else pygltflib.UNSIGNED_SHORT,
-          count=len(index_data.flatten()),
-          type=pygltflib.SCALAR,
-          min=[int(index_data.min())],
-          max=[int(index_data.max())]
-        ))
+      if self.quantize:
+        # Positions are stored relative to their bounding box, the mesh node
+        # carries the transform that maps them back. The scale is uniform so
+        # normals are not distorted by the node transform.
+        low = positions.min(axis=0)
+        high = positions.max(axis=0)
+        center = (low + high) / 2
+        extent = float((high - low).max()) / 2
+        if(extent == 0):
+          extent = 1.0
 
-        (index_offset, index_length) = self.add_to_buffer(index_data.flatten().tobytes())
-        self.bufferViews.append(pygltflib.BufferView(
-          buffer=0,
-          byteOffset=index_offset,
-          byteLength=index_length,
-          target=pygltflib.ELEMENT_ARRAY_BUFFER
-        ))
+        (points_accessor, decoded) = self.add_attribute(
+          (positions - center) / extent, ("int16", pygltflib.SHORT))
+        self.report_error("POSITION", positions, decoded * extent + center)
+
+        (offset, scale) = self.uv_transform or (np.zeros(2), np.ones(2))
+        (uv_accessor, decoded) = self.add_attribute(
+          (uvs - offset) / scale, ("uint16", pygltflib.UNSIGNED_SHORT))
+        self.report_error("TEXCOORD_0", uvs, decoded * scale + offset)
 
-        material = self.add_to_material(rwx['materials'][0:material])
+        (normal_accessor, decoded) = self.add_attribute(normals, ("int16", pygltflib.SHORT))
+        self.report_error("NORMAL", normals, normalize(decoded))
+
+        self.extensions.add("KHR_mesh_quantization")
+
+        mesh_node = pygltflib.Node(translation=center.tolist(), scale=[extent] * 3)
+        node.children.append(len(self.nodes))
+        self.nodes.append(mesh_node)
+      else:
+        (points_accessor, _) = self.add_attribute(positions)
+        (uv_accessor, _) = self.add_attribute(uvs)
+        (normal_accessor, _) = self.add_attribute(normals)
+        mesh_node = node
+
+      mesh = len(self.meshes)
+
+      primitives = []
+      for material in np.unique(clump['materials']):
+        selected = clump['materials'] == material
+        triangles = clump['indices'][selected]
+
+        # Tag -> [mesh, primitive, first index, index count] ranges of
+        # tagged surfaces
+        for (tag, start, count) in tag_runs(clump['tags'][selected]):
+          self.tags.setdefault(str(tag), []).append(
+            [mesh, len(primitives), start * 3, count * 3])
 
         primitives.append(pygltflib.Primitive(
-          attributes=pygltflib.Attributes(POSITION=points_accessor), indices=index_accessor, material=material
+          attributes=pygltflib.Attributes(
+            POSITION=points_accessor, NORMAL=normal_accessor, TEXCOORD_0=uv_accessor),
+          indices=self.add_indices(triangles),
+          material=int(material)
         ))
 
-      mesh = len(self.meshes)
       self.meshes.append(pygltflib.Mesh(primitives=primitives))
 
-      node.mesh = mesh
+      mesh_node.mesh = mesh
 
-    if 'children' in rwx and len(rwx['children']) > 0:
-      for child in rwx['children']:
-        node.children.append(self.convert(child['clump']))
+    for child in clump['children']:
+      node.children.append(self.convert_clump(child))
 
     return node_index
 
 if __name__ == "__main__":
   from rwxreader import RwxReader
 
+  args = [a for a in sys.argv[1:] if not a.startswith('--')]
+  quantize = '--quantize' in sys.argv
+  crease_angle = DEFAULT_CREASE_ANGLE
+  for a in sys.argv[1:]:
+    if a.startswith('--crease='):
+      crease_angle = float(a[len('--crease='):])
+
   filename = '00PS.RWX'
-  if len(sys.argv) > 1:
-    filename = sys.argv[1]
+  if len(args) > 0:
+    filename = args[0]
+
+  with open(filename, 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      rwx = RwxReader(buffer)
+
+  gltf = RwxToGltf(rwx.model, quantize=quantize, crease_angle=crease_angle)
+  gltf.save(os.path.splitext(filename)[0] + '.gltf')
 
-  with open(filename) as f:
-    rwx = RwxReader(f)
-    gltf = RwxToGltf(rwx.model)
-    gltf.save(os.path.splitext(filename)[0] + '.gltf')
+  for (attribute, error) in gltf.quantization_error.items():
+    print("%s max quantization error %g" % (attribute, error))
@@ -0,0 +1,4 @@
+import os, sys
+
+# The tools are plain scripts importing each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
@@ -0,0 +1,191 @@
+import asyncio, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import model_server
+from model_server import ModelServer, parse_etags
+
+MODEL = b"""ModelBegin
+ClumpBegin
+  Color 1 0 0
+  Vertex 0 0 0 UV 0 0
+  Vertex 1 0 0 UV 1 0
+  Vertex 1 1 0 UV 1 1
+  Quad 1 2 3 1 Tag 100
+ClumpEnd
+ModelEnd
+"""
+
+async def fetch(port, path, headers=()):
+    (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+    request = "GET %s HTTP/1.1\r\nHost: localhost\r\n" % path
+    request += "".join("%s: %s\r\n" % header for header in headers)
+    writer.write((request + "\r\n").encode('latin-1'))
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    (head, _, body) = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    response_headers = dict(line.split(': ', 1) for line in lines[1:])
+    return (status, response_headers, body)
+
+def run_server(tmp_path, monkeypatch, test):
+    (tmp_path / "model.rwx").write_bytes(MODEL)
+    (tmp_path / "broken.rwx").write_bytes(b"ModelBegin\nClumpBegin\nBogus 1\nClumpEnd\n")
+    with zipfile.ZipFile(str(tmp_path / "pack.zip"), 'w') as zf:
+        zf.writestr("first.rwx", MODEL)
+        zf.writestr("Second.RWX", MODEL.replace(b"Vertex 1 1 0", b"Vertex 2 2 0"))
+
+    calls = []
+    convert_model = model_server.convert_model
+
+    def counting_convert_model(*args):
+        calls.append(args)
+        time.sleep(0.2)
+        return convert_model(*args)
+
+    monkeypatch.setattr(model_server, 'convert_model', counting_convert_model)
+
+    async def main():
+        server = ModelServer(str(tmp_path))
+        # Threads share the call log with the test, unlike worker processes
+        server.executor.shutdown()
+        server.executor = ThreadPoolExecutor(max_workers=4)
+
+        http = await server.start(port=0)
+        try:
+            await test(http.sockets[0].getsockname()[1], calls)
+        finally:
+            http.close()
+            await http.wait_closed()
+            server.close()
+
+    asyncio.run(main())
+
+def test_concurrent_requests_share_one_conversion(tmp_path, monkeypatch):
+    async def test(port, calls):
+        responses = await asyncio.gather(*[fetch(port, '/models/model.gltf') for _ in range(10)])
+
+        assert len(calls) == 1
+        assert set(status for (status, _, _) in responses) == {200}
+        assert len(set(body for (_, _, body) in responses)) == 1
+
+    run_server(tmp_path, monkeypatch, test)
+
+def test_etag_revalidation(tmp_path, monkeypatch):
+    async def test(port, calls):
+        (status, headers, body) = await fetch(port, '/models/model.json')
+        assert status == 200
+        etag = headers['ETag']
+
+        for value in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+            (status, _, body) = await fetch(port, '/models/model.json', [('If-None-Match', value)])
+            assert status == 304
+            assert body == b''
+
+        (status, _, _) = await fetch(port, '/models/model.json', [('If-None-Match', '"other"')])
+        assert status == 200
+        assert len(calls) == 1
+
+    run_server(tmp_path, monkeypatch, test)
+
+def test_missing_model(tmp_path, monkeypatch):
+    async def test(port, calls):
+        assert (await fetch(port, '/models/missing.gltf'))[0] == 404
+        assert (await fetch(port, '/models/../model.gltf'))[0] == 404
+        assert len(calls) == 0
+
+    run_server(tmp_path, monkeypatch, test)
+
+def test_parse_error(tmp_path, monkeypatch):
+    async def test(port, calls):
+        (status, _, body) = await fetch(port, '/models/broken.gltf')
+        assert status == 500
+        assert b'Unexpected bogus' in body
+
+    run_server(tmp_path, monkeypatch, test)
+
+def test_zip_members(tmp_path, monkeypatch):
+    async def test(port, calls):
+        (status, _, first) = await fetch(port, '/models/pack.json')
+        assert status == 200
+        assert (await fetch(port, '/models/pack/first.json'))[2] == first
+
+        (status, _, second) = await fetch(port, '/models/pack/second.json')
+        assert status == 200
+        assert second != first
+        assert [args[1] for args in calls] == ["first.rwx", "first.rwx", "Second.RWX"]
+
+        assert (await fetch(port, '/models/pack/third.json'))[0] == 404
+        assert (await fetch(port, '/models/model/model.json'))[0] == 404
+
+    run_server(tmp_path, monkeypatch, test)
+
+def test_parse_etags():
+    assert parse_etags(' "a", W/"b",c ') == {'a', 'b', 'c'}
+
+def serve_once(server, test):
+    async def main():
+        http = await server.start(port=0)
+        try:
+            await test(http.sockets[0].getsockname()[1])
+        finally:
+            http.close()
+            await http.wait_closed()
+            server.close()
+
+    asyncio.run(main())
+
+def test_disk_cache_survives_restart(tmp_path):
+    (tmp_path / "model.rwx").write_bytes(MODEL)
+    cache_path = str(tmp_path / "cache")
+
+    # Converts on a real process pool and caches the result on disk
+    first = ModelServer(str(tmp_path), cache_path, workers=1)
+    responses = []
+
+    async def convert(port):
+        responses.append(await fetch(port, '/models/model.json'))
+
+    serve_once(first, convert)
+    (status, headers, body) = responses[0]
+    assert status == 200
+    assert [first.cache_filename(key) for key in first.disk_cache] == [
+        str(tmp_path / "cache" / ("model-%d.json" % (tmp_path / "model.rwx").stat().st_mtime_ns))]
+
+    # A new server picks the file up and serves it without converting
+    second = ModelServer(str(tmp_path), cache_path, workers=1)
+    assert list(second.disk_cache) == list(first.disk_cache)
+    assert second.disk_size == len(body)
+
+    calls = []
+    def counting_convert(*args):
+        calls.append(args)
+        return ModelServer.convert(second, *args)
+    second.convert = counting_convert
+
+    async def serve_cached(port):
+        assert await fetch(port, '/models/model.json') == (status, headers, body)
+
+    serve_once(second, serve_cached)
+    assert calls == []
+
+def test_disk_cache_eviction(tmp_path):
+    (tmp_path / "model.rwx").write_bytes(MODEL)
+    (tmp_path / "other.rwx").write_bytes(MODEL.replace(b"Vertex 1 1 0", b"Vertex 2 2 0"))
+
+    server = ModelServer(str(tmp_path), str(tmp_path / "cache"), disk_limit=1, workers=1)
+
+    async def test(port):
+        assert (await fetch(port, '/models/model.json'))[0] == 200
+        assert (await fetch(port, '/models/other.json'))[0] == 200
+
+    serve_once(server, test)
+
+    # Only the most recent conversion fits, the older one is removed from disk
+    cached = "other-%d.json" % (tmp_path / "other.rwx").stat().st_mtime_ns
+    assert [key[0] for key in server.disk_cache] == ["other"]
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == [cached]
+    assert server.disk_size == (tmp_path / "cache" / cached).stat().st_size
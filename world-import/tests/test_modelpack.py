@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from modelpack import PackReader, PackWriter, compact, read_index
+
+def write_pack(filename, members):
+    with PackWriter(filename) as writer:
+        for (name, data) in members:
+            writer.add(name, data)
+
+def read_pack(filename):
+    with PackReader(filename) as reader:
+        members = {}
+        for name in reader.names():
+            assert reader.verify(name)
+            view = reader.get(name)
+            members[name] = bytes(view)
+            view.release()
+
+        return members
+
+def test_appends_keep_earlier_members(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    write_pack(filename, [("a.json", b"first")])
+    write_pack(filename, [("b.json", b"second"), ("a.json", b"replaced")])
+
+    assert read_pack(filename) == {"a.json": b"replaced", "b.json": b"second"}
+
+def test_rescans_to_last_valid_footer(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    write_pack(filename, [("a.json", b"first")])
+    size = os.path.getsize(filename)
+
+    # A member and a torn footer left by a crash
+    with open(filename, 'ab') as f:
+        f.write(b"lost" + b"{\"a.json\":[8,4," + b"AWMPACK\x01")
+
+    with open(filename, 'rb') as f:
+        (index, end) = read_index(f.read())
+    assert index == {"a.json": [8, 5, index["a.json"][2]]}
+    assert end == size
+
+    assert read_pack(filename) == {"a.json": b"first"}
+
+def test_reopening_truncates_interrupted_append(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    write_pack(filename, [("a.json", b"first")])
+    size = os.path.getsize(filename)
+
+    # Members added without reaching close() never get a footer
+    writer = PackWriter(filename)
+    writer.add("b.json", b"second" * 100)
+    writer.f.close()
+    assert os.path.getsize(filename) > size
+
+    writer = PackWriter(filename)
+    assert list(writer.index) == ["a.json"]
+    assert os.path.getsize(filename) == size
+    writer.close()
+
+    assert read_pack(filename) == {"a.json": b"first"}
+
+def test_unchanged_members_are_skipped(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    write_pack(filename, [("a.json", b"first" * 100)])
+    with PackReader(filename) as reader:
+        offset = reader.index["a.json"][0]
+    size = os.path.getsize(filename)
+
+    write_pack(filename, [("a.json", b"first" * 100)])
+
+    with PackReader(filename) as reader:
+        assert reader.index["a.json"][0] == offset
+    # Only a new footer was appended
+    assert os.path.getsize(filename) - size < 100
+
+def test_compact(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    for i in range(5):
+        write_pack(filename, [("a.json", b"version %d" % i * 100), ("b.json", b"b" * i)])
+    size = os.path.getsize(filename)
+
+    compact(filename)
+
+    assert os.path.getsize(filename) < size
+    assert read_pack(filename) == {"a.json": b"version 4" * 100, "b.json": b"bbbb"}
+    assert not os.path.exists(filename + ".tmp")
+
+def test_close_with_live_view(tmp_path):
+    filename = str(tmp_path / "models.pack")
+    write_pack(filename, [("a.json", b"first")])
+
+    reader = PackReader(filename)
+    view = reader.get("a.json")
+    with pytest.raises(BufferError):
+        reader.close()
+
+    # The reader is still usable until every view is released
+    assert bytes(reader.get("a.json")) == b"first"
+    view.release()
+    reader.close()
+    reader.close()
@@ -0,0 +1,97 @@
+import numpy
+
+from normals import generate_normals
+
+def cube():
+    positions = numpy.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)],
+                            dtype="float32")
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    indices = numpy.array([t for (a, b, c, d) in quads for t in ((a, b, c), (a, c, d))],
+                          dtype="uint32")
+    return (positions, indices)
+
+def fan(count, height=0.0):
+    angles = numpy.linspace(0, 2 * numpy.pi, count, endpoint=False)
+    positions = numpy.vstack((
+        [[0.0, 0.0, height]],
+        numpy.column_stack((numpy.cos(angles), numpy.sin(angles), numpy.zeros(count)))))
+    indices = numpy.array([[0, i + 1, (i + 1) % count + 1] for i in range(count)],
+                          dtype="uint32")
+    return (positions, indices)
+
+def check_geometry(positions, indices, vertex_map, new_indices):
+    assert numpy.array_equal(positions[vertex_map][new_indices], positions[indices])
+
+def test_cube_splits_at_crease():
+    (positions, indices) = cube()
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 60)
+
+    assert len(vertex_map) == 24
+    check_geometry(positions, indices, vertex_map, new_indices)
+
+    # Every corner gets its face's axis aligned normal
+    assert numpy.allclose(numpy.abs(normals).max(axis=1), 1.0)
+    assert numpy.allclose(numpy.abs(normals).sum(axis=1), 1.0)
+
+def test_cube_smooth_above_crease():
+    (positions, indices) = cube()
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 180)
+
+    assert len(vertex_map) == 8
+    check_geometry(positions, indices, vertex_map, new_indices)
+
+def test_plane_shares_vertices():
+    positions = numpy.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], dtype="float32")
+    indices = numpy.array([[0, 1, 2], [0, 2, 3]], dtype="uint32")
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 60)
+
+    assert sorted(vertex_map.tolist()) == [0, 1, 2, 3]
+    check_geometry(positions, indices, vertex_map, new_indices)
+    assert numpy.allclose(normals, [0, 0, 1])
+
+def test_flat_fan_is_not_split():
+    (positions, indices) = fan(5000)
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 60)
+
+    assert len(vertex_map) == len(positions)
+    assert numpy.allclose(normals, [0, 0, 1])
+
+def test_chunking_does_not_change_result():
+    (positions, indices) = fan(64, height=5.0)
+    expected = generate_normals(positions, indices, 60)
+
+    for chunk_size in (1, 7, 100):
+        result = generate_normals(positions, indices, 60, chunk_size=chunk_size)
+        for (a, b) in zip(expected, result):
+            assert numpy.array_equal(a, b)
+
+def test_shallow_cone_tip_is_smooth():
+    (positions, indices) = fan(5000, height=0.5)
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 60)
+
+    tip = vertex_map == 0
+    assert tip.sum() == 1
+    assert numpy.allclose(normals[tip], [0, 0, 1])
+
+def test_steep_cone_tip_above_group_limit():
+    (positions, indices) = fan(5000, height=10.0)
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices, 60,
+                                                          group_limit=100)
+
+    # Every face is further than the crease angle from the tip's mean
+    # normal, so each keeps its own
+    check_geometry(positions, indices, vertex_map, new_indices)
+    tip_corners = new_indices[:, 0]
+    assert len(numpy.unique(tip_corners)) == 5000
+    faces = numpy.cross(positions[indices[:, 1]] - positions[indices[:, 0]],
+                        positions[indices[:, 2]] - positions[indices[:, 0]])
+    faces /= numpy.linalg.norm(faces, axis=1, keepdims=True)
+    assert numpy.allclose(normals[tip_corners], faces)
+
+def test_empty_mesh():
+    positions = numpy.zeros((3, 3), dtype="float32")
+    indices = numpy.zeros((0, 3), dtype="uint32")
+    (vertex_map, new_indices, normals) = generate_normals(positions, indices)
+
+    assert len(new_indices) == 0
+    assert normals.shape == (3, 3)
@@ -0,0 +1,51 @@
+import mmap
+
+import pytest
+
+from rwxreader import RwxReader
+
+MODEL = (b"ModelBegin\r\n"
+         b"ProtoBegin square\r\n"
+         b"  Vertex 0 0 0 UV 0 0 # corner\r\n"
+         b"  Vertex 1 0 0 UV 1 0\r\n"
+         b"  Vertex 1 1 0 UV 1 1\r\n"
+         b"  Vertex 0 1 0 UV 0 1\r\n"
+         b"  Quad 1 2 3 4 Tag 100\r\n"
+         b"ProtoEnd\r\n"
+         b"ClumpBegin\r\n"
+         b"  Color 1 0.5 0 # orange\r\n"
+         b"  ProtoInstance square\r\n"
+         b"ClumpEnd\r\n"
+         b"ModelEnd\r\n")
+
+def check_model(model):
+    clump = model['children'][0]['clump']
+
+    assert [(v['x'], v['y'], v['z'], v['u'], v['v']) for v in clump['vertices']] == [
+        (0.0, 0.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 1.0, 0.0),
+        (1.0, 1.0, 0.0, 1.0, 1.0), (0.0, 1.0, 0.0, 0.0, 1.0)]
+    assert [(t['indices'], t['tag']) for t in clump['triangles']] == [
+        ([1, 2, 3], 100), ([1, 3, 4], 100)]
+    assert clump['materials'][0]['type'] == 'color'
+    assert (clump['materials'][0]['g'], clump['materials'][0]['b']) == (0.5, 0.0)
+
+def test_bytes():
+    check_model(RwxReader(MODEL).model)
+
+def test_memoryview():
+    check_model(RwxReader(memoryview(MODEL)).model)
+
+def test_mmap(tmp_path):
+    (tmp_path / "model.rwx").write_bytes(MODEL)
+
+    with open(str(tmp_path / "model.rwx"), 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            check_model(RwxReader(buffer).model)
+
+def test_parse_error_line():
+    source = MODEL.replace(b"  ProtoInstance square\r\n", b"  ProtoInstance square\r\n  Bogus 1 # here\r\n")
+
+    with pytest.raises(Exception) as error:
+        RwxReader(memoryview(source))
+
+    assert str(error.value) == "Unexpected bogus, line 12\nBogus 1 # here"
@@ -0,0 +1,54 @@
+import numpy
+import pygltflib
+
+from rwxreader import RwxReader
+from rwxtogltf import RwxToGltf
+
+def tiled_grid(size=12, repeat=3.7, offset=-1.3):
+    """
+    Returns an RWX grid whose texture repeats several times across it
+    """
+    lines = [b"modelbegin", b"clumpbegin", b"texture stone"]
+    for y in range(size):
+        for x in range(size):
+            lines.append(b"vertex %.4f %.4f %.4f uv %.5f %.5f" % (
+                x * 0.37, numpy.sin(x + y) * 0.21, y * 0.53,
+                offset + repeat * x / (size - 1), offset + repeat * y / (size - 1)))
+    for y in range(size - 1):
+        for x in range(size - 1):
+            a = y * size + x + 1
+            lines.append(b"quad %d %d %d %d" % (a, a + size, a + size + 1, a + 1))
+    lines += [b"clumpend", b"modelend", b""]
+
+    return b"\n".join(lines)
+
+def test_quantized_attributes():
+    gltf = RwxToGltf(RwxReader(tiled_grid()).model, quantize=True)
+    attributes = gltf.meshes[0].primitives[0].attributes
+
+    for (accessor, component_type) in ((attributes.POSITION, pygltflib.SHORT),
+                                       (attributes.NORMAL, pygltflib.SHORT),
+                                       (attributes.TEXCOORD_0, pygltflib.UNSIGNED_SHORT)):
+        assert gltf.accessors[accessor].componentType == component_type
+        assert gltf.accessors[accessor].normalized
+
+    assert gltf.extensions == {"KHR_mesh_quantization", "KHR_texture_transform"}
+
+    texture = gltf.materials[0].pbrMetallicRoughness["baseColorTexture"]
+    transform = texture["extensions"]["KHR_texture_transform"]
+    assert numpy.allclose(transform["offset"], [-1.3, -1.3])
+    assert numpy.allclose(transform["scale"], [3.7, 3.7])
+
+    # Every attribute decodes to within one quantization step
+    (low, high) = gltf.rwx.bounds()
+    extent = (high - low).max() / 2
+    assert 0 < gltf.quantization_error["POSITION"] < extent / 32767
+    assert 0 < gltf.quantization_error["TEXCOORD_0"] < 3.7 / 65535
+    assert 0 < gltf.quantization_error["NORMAL"] < 1 / 32767
+
+def test_uvs_in_unit_range_need_no_transform():
+    gltf = RwxToGltf(RwxReader(tiled_grid(repeat=1.0, offset=0.0)).model, quantize=True)
+
+    assert gltf.extensions == {"KHR_mesh_quantization"}
+    assert "extensions" not in gltf.materials[0].pbrMetallicRoughness["baseColorTexture"]
+    assert gltf.quantization_error["TEXCOORD_0"] < 1 / 65535
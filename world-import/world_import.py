@@ -1,9 +1,19 @@
 import sys, os
 
 from models import models_import
+from normals import DEFAULT_CREASE_ANGLE
 
-def world_import(path):
-    models_import(os.path.join(path, "models"))
+def world_import(path, pack=None, catalog=None, crease_angle=DEFAULT_CREASE_ANGLE):
+    models_import(os.path.join(path, "models"), pack, catalog, crease_angle)
 
 if __name__=='__main__':
-    world_import(sys.argv[1])
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    crease_angle = DEFAULT_CREASE_ANGLE
+    for a in sys.argv[1:]:
+        if a.startswith('--crease='):
+            crease_angle = float(a[len('--crease='):])
+
+    world_import(args[0],
+                 args[1] if len(args) > 1 else None,
+                 args[2] if len(args) > 2 else None,
+                 crease_angle)